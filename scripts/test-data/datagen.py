@@ -1,81 +1,390 @@
+import base64
+import hashlib
+import mmap
+import multiprocessing
 import os
-import json
+import re
+import shutil
 import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from typing import List
+
+import numpy as np
+import onnxruntime as ort
+import orjson
 from fastembed import TextEmbedding
 
 # Configuration
 DOC_CORPUS_DIR = os.path.join(os.path.dirname(__file__), "doc-corpus")
 OUTPUT_FILE = os.path.join(os.path.dirname(__file__), "output.json")
+EMBEDDINGS_NPY = os.path.join(os.path.dirname(__file__), "output-embeddings.npy")
 CHUNK_SIZE = 500  # characters
 OVERLAP = 50      # characters
+BATCH_SIZE = 256  # chunks per embedding batch
 
-def chunk_text(text: str, chunk_size: int, overlap: int) -> List[str]:
-    """
-    Sliding window chunking that respects word boundaries.
-    """
-    if not text:
-        return []
-    
-    chunks = []
-    text_len = len(text)
+# "chars" chunks on character windows (default); "tokens" chunks on windows
+# of the embedder's own tokens, which makes every chunk the same unit of
+# model work and nearly eliminates padding waste in batches.
+CHUNK_UNIT = os.environ.get("CHUNK_UNIT", "chars")
+TOKEN_CHUNK_SIZE = 128  # tokens per chunk when CHUNK_UNIT=tokens
+TOKEN_OVERLAP = 16      # tokens of overlap between consecutive chunks
+
+# With EMBED_WORKERS > 0, embedding batches fan out over a fork()ed pool
+# whose workers copy-on-write share the already-loaded model — no per-worker
+# model load or extra copy of the weights. Linux/macOS only (needs fork).
+EMBED_WORKERS = int(os.environ.get("EMBED_WORKERS", "0"))
+
+# "json" emits embeddings as JSON float lists (default, ChromaDB-compatible);
+# "base64" emits one {dtype, shape, data} object with the raw float32 buffer,
+# which is 3-5x smaller and far faster to write and parse.
+EMBEDDING_FORMAT = os.environ.get("EMBEDDING_FORMAT", "json")
+
+# "json" builds the SOA output.json (default); "jsonl" streams one row per
+# chunk to output.jsonl as embeddings are produced, with the vectors living
+# only in the memmapped .npy — constant memory for very large corpora.
+OUTPUT_FORMAT = os.environ.get("OUTPUT_FORMAT", "json")
+OUTPUT_JSONL = os.path.join(os.path.dirname(__file__), "output.jsonl")
+
+# Matches one word (run of non-whitespace). Compiled once so chunking does a
+# single C-level scan of the text instead of a Python-level rfind per chunk.
+_WORD_RE = re.compile(r"\S+")
+_WORD_RE_BYTES = re.compile(rb"\S+")
+
+try:
+    # Optional: with numba installed the boundary walk below compiles to
+    # native code; without it the same function runs as pure Python.
+    from numba import njit
+except ImportError:
+    njit = None
+
+def _chunk_bounds_impl(starts, ends, text_len, chunk_size, overlap):
+    cap = 16
+    bounds = np.empty((cap, 2), dtype=np.int64)
+    n = 0
+    last_word_end = ends[-1]
     start = 0
-    
+
     while start < text_len:
-        # Tentative end
-        end = min(start + chunk_size, text_len)
-        
-        # If not at the very end of text, try to snap back to a space
-        # to avoid cutting words in half.
-        if end < text_len:
-            # Look for last space in the current slice
-            last_space = text.rfind(' ', start, end)
-            if last_space != -1:
-                end = last_space + 1  # Include the trailing space in this chunk
-        
-        # Extract chunk
-        chunk = text[start:end]
-        if chunk.strip(): # Avoid empty whitespace chunks
-            chunks.append(chunk)
-        
-        # If we reached the end, stop
-        if end == text_len:
+        limit = start + chunk_size
+        if limit >= text_len:
+            end = text_len
+        else:
+            # Snap back to the end of the last word that fits in the window.
+            wi = np.searchsorted(ends, limit, side="right") - 1
+            if wi >= 0 and ends[wi] > start:
+                end = ends[wi]
+            else:
+                # No word ends inside this window: either an oversized word
+                # straddles it, or the window is pure whitespace (a run
+                # longer than chunk_size). Jump to the next word instead of
+                # emitting a blank chunk in the latter case.
+                nj = np.searchsorted(ends, start, side="right")
+                if starts[nj] >= limit:
+                    start = starts[nj]
+                    continue
+                # One huge word fills the window: hard cut, as before.
+                end = limit
+
+        if n == cap:
+            cap *= 2
+            grown = np.empty((cap, 2), dtype=np.int64)
+            grown[:n] = bounds[:n]
+            bounds = grown
+        bounds[n, 0] = start
+        bounds[n, 1] = end
+        n += 1
+
+        # If we consumed the last word, stop
+        if end >= last_word_end:
             break
-            
-        # Calculate next start position
-        # We want the next chunk to overlap the previous one by `overlap` amount
-        # relative to the current `end`.
+
+        # Next chunk overlaps this one by `overlap`, aligned to the start of
+        # the word containing that offset.
         target_start = end - overlap
-        
-        # Adjust target_start to align with a word boundary (start of word)
-        # We look for a space before target_start
-        start_space = text.rfind(' ', start, target_start)
-        if start_space != -1:
-            next_start = start_space + 1
+        ni = np.searchsorted(starts, target_start, side="right") - 1
+        if ni >= 0 and starts[ni] > start:
+            next_start = starts[ni]
         else:
-            # Fallback if no space found (e.g. one huge word or first chunk)
+            # Fallback if the target sits inside the word the current chunk
+            # started on (e.g. one huge word)
             next_start = target_start
-            
-        # Guarantee progress to prevent infinite loops
+
         if next_start <= start:
-            next_start = start + 1
-            
+            # Overlap would restart at or before the current chunk (a short
+            # word cluster followed by a long gap). Forgo the overlap and
+            # jump to the first word past this chunk's end rather than
+            # re-emitting shifted copies of the same window.
+            nk = np.searchsorted(starts, end, side="left")
+            if nk < len(starts):
+                next_start = starts[nk]
+            else:
+                next_start = end
+
         start = next_start
-        
+
+    return bounds[:n]
+
+if njit is not None:
+    _chunk_bounds_impl = njit(cache=True)(_chunk_bounds_impl)
+
+def _chunk_bounds(starts: np.ndarray, ends: np.ndarray, text_len: int,
+                  chunk_size: int, overlap: int) -> np.ndarray:
+    """
+    Compute (start, end) offsets for every chunk from sorted word start
+    and end offset arrays, as an (n_chunks, 2) int64 array. Boundary
+    snapping is one np.searchsorted per chunk; the loop itself stays
+    scalar because each chunk's start depends on the previous chunk's
+    end, which is why it is written numba-compilable on int64 arrays
+    rather than vectorized.
+    """
+    return _chunk_bounds_impl(starts, ends, text_len, chunk_size, overlap)
+
+def chunk_text(text: str, chunk_size: int, overlap: int) -> List[str]:
+    """
+    Sliding window chunking that respects word boundaries.
+
+    The text is pre-tokenized once into word spans, so snapping a chunk
+    boundary to a word is a binary search over span offsets instead of an
+    O(chunk_size) rfind scan per chunk.
+    """
+    if not text:
+        return []
+
+    spans = np.array([m.span() for m in _WORD_RE.finditer(text)], dtype=np.int64)
+    if spans.size == 0:
+        return []
+
+    # Every boundary pair either ends at a word end or hard-cuts inside an
+    # oversized word — _chunk_bounds skips wordless windows — so no chunk
+    # can be all whitespace and the old per-chunk strip() liveness test
+    # (which allocated a stripped copy of every chunk) stays unnecessary.
+    return [text[start:end]
+            for start, end in _chunk_bounds(spans[:, 0], spans[:, 1],
+                                            len(text), chunk_size, overlap)]
+
+def chunk_text_tokens(tokenizer, text: str) -> List[str]:
+    """
+    Sliding window chunking measured in the embedder's tokens: encode the
+    document once, slice TOKEN_CHUNK_SIZE-token windows with TOKEN_OVERLAP,
+    and map each window back to a character span via the encoding offsets.
+    Chunk boundaries align with the model's unit of work, so batches of
+    these chunks pad to nearly identical lengths.
+    """
+    if not text:
+        return []
+
+    enc = tokenizer.encode(text, add_special_tokens=False)
+    offsets = enc.offsets
+    n_tokens = len(offsets)
+    if n_tokens == 0:
+        return []
+
+    chunks = []
+    step = TOKEN_CHUNK_SIZE - TOKEN_OVERLAP
+    for t0 in range(0, n_tokens, step):
+        t1 = min(t0 + TOKEN_CHUNK_SIZE, n_tokens)
+        chunks.append(text[offsets[t0][0]:offsets[t1 - 1][1]])
+        if t1 == n_tokens:
+            break
     return chunks
 
+def _expand_meta(source: str, chunk_index: int) -> dict:
+    """Expand a compact (source, chunk_index) pair to the output dict form."""
+    return {
+        "source": source,
+        "chunk_index": chunk_index,
+        "version": 1,
+        "type": "text_segment"
+    }
+
+def _read_file(filename: str):
+    """Read one corpus file; errors are reported per file."""
+    try:
+        with open(os.path.join(DOC_CORPUS_DIR, filename), "r", encoding="utf-8") as f:
+            return filename, f.read()
+    except Exception as e:
+        print(f"Error reading {filename}: {e}")
+        return filename, None
+
+def _chunk_buffer(buf, chunk_size: int, overlap: int) -> List[str]:
+    """
+    Chunk a read-only byte buffer (e.g. an mmapped file) without ever
+    materializing the whole document as a str: word spans come from a
+    bytes regex over the buffer, and only the bytes of each emitted
+    chunk are decoded. Offsets are bytes rather than characters;
+    whitespace-snapped boundaries never split a codepoint, and hard-cut
+    boundaries are realigned to lead bytes below.
+    """
+    spans = np.array([m.span() for m in _WORD_RE_BYTES.finditer(buf)], dtype=np.int64)
+    if spans.size == 0:
+        return []
+
+    chunks = []
+    buf_len = len(buf)
+    for start, end in _chunk_bounds(spans[:, 0], spans[:, 1], buf_len, chunk_size, overlap):
+        # Hard cuts inside an oversized word are byte offsets and can land
+        # mid-codepoint; snap both boundaries to UTF-8 lead bytes (0x80..
+        # 0xBF are continuation bytes) so the decode below cannot raise.
+        start = int(start)
+        end = int(end)
+        while start < end and buf[start] & 0xC0 == 0x80:
+            start += 1
+        while start < end < buf_len and buf[end] & 0xC0 == 0x80:
+            end -= 1
+        if start < end:
+            chunks.append(buf[start:end].decode("utf-8"))
+    return chunks
+
+def _read_and_chunk(filename: str):
+    """
+    mmap one corpus file and chunk it. Top-level so Pool workers can
+    pickle it; errors are reported per file, as before. The mmap keeps
+    the file out of Python memory entirely — only chunk-sized spans are
+    ever decoded.
+    """
+    filepath = os.path.join(DOC_CORPUS_DIR, filename)
+    try:
+        if os.path.getsize(filepath) == 0:
+            return filename, []
+        with open(filepath, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return filename, _chunk_buffer(mm, CHUNK_SIZE, OVERLAP)
+    except Exception as e:
+        print(f"Error reading {filename}: {e}")
+        return filename, []
+
+# Quantized weight variants that may sit next to the FP32 model file,
+# in preference order. INT8 MatMuls roughly double CPU throughput.
+_QUANTIZED_ONNX = ("model_quantized.onnx", "model_int8.onnx", "model_optimized.onnx")
+
+def _session_and_tokenizer(model: TextEmbedding):
+    """
+    Borrow the tokenizer fastembed already loaded, and build an ONNX
+    session tuned for bulk inference: the CUDA provider when one is
+    available, otherwise quantized weights (when a quantized file is
+    present in the model dir) and intra-op threads set to all cores.
+    Falls back to fastembed's own session if the model path is not
+    discoverable.
+    """
+    inner = model.model  # fastembed's onnx implementation
+    sess = inner.model
+    tokenizer = inner.tokenizer
+
+    model_path = getattr(sess, "_model_path", None)
+    if model_path:
+        model_path = Path(model_path)
+        so = ort.SessionOptions()
+        if "CUDAExecutionProvider" in ort.get_available_providers():
+            # Matmul-bound embedding moves to the GPU; keep the FP32
+            # weights since INT8 kernels only help on CPU.
+            providers = [
+                ("CUDAExecutionProvider",
+                 {"device_id": 0, "cudnn_conv_algo_search": "EXHAUSTIVE"}),
+                "CPUExecutionProvider",
+            ]
+        else:
+            providers = ["CPUExecutionProvider"]
+            so.intra_op_num_threads = os.cpu_count()
+            for name in _QUANTIZED_ONNX:
+                candidate = model_path.with_name(name)
+                if candidate.exists():
+                    model_path = candidate
+                    break
+        sess = ort.InferenceSession(str(model_path), sess_options=so, providers=providers)
+    return sess, tokenizer
+
+def _forward(sess, input_names, batch) -> np.ndarray:
+    """Run one padded batch of encodings and return normalized CLS rows."""
+    # Pad the batch to its own max length
+    max_len = max(len(enc.ids) for enc in batch)
+    input_ids = np.zeros((len(batch), max_len), dtype=np.int64)
+    attention_mask = np.zeros((len(batch), max_len), dtype=np.int64)
+    for row, enc in enumerate(batch):
+        n = len(enc.ids)
+        input_ids[row, :n] = enc.ids
+        attention_mask[row, :n] = enc.attention_mask
+
+    feed = {"input_ids": input_ids, "attention_mask": attention_mask}
+    if "token_type_ids" in input_names:
+        feed["token_type_ids"] = np.zeros_like(input_ids)
+
+    # First output is the last hidden state; BGE models use CLS pooling
+    hidden = sess.run(None, feed)[0]
+    cls = hidden[:, 0]
+    return cls / np.linalg.norm(cls, axis=1, keepdims=True)
+
+def embed_chunks(model: TextEmbedding, chunks: List[str]):
+    """
+    Embed chunks by tokenizing the whole list in one encode_batch call and
+    feeding the ONNX session in fixed-size slices.
+
+    A single tokenizer invocation avoids per-batch Python dispatch inside
+    fastembed's embed(), and the numpy slices go straight into the session.
+    Yields one normalized embedding per chunk, in order.
+    """
+    sess, tokenizer = _session_and_tokenizer(model)
+
+    # fastembed enables padding on the tokenizer, which would pad every
+    # encoding in this single encode_batch call to the corpus-wide max
+    # length — forcing every forward pass below to run at that width.
+    # Turn it off (truncation stays on); each batch pads itself.
+    tokenizer.no_padding()
+    encodings = tokenizer.encode_batch(chunks)
+    input_names = {i.name for i in sess.get_inputs()}
+
+    # Smart batching: run batches in token-length order so each one is
+    # length-homogeneous and pads to its own (small) max, then scatter the
+    # results back and yield in the original chunk order. Sort on the
+    # attention-mask sum — the real token count even if the encodings
+    # were padded — rather than len(ids), which padding equalizes.
+    lengths = [sum(enc.attention_mask) for enc in encodings]
+    order = sorted(range(len(encodings)), key=lengths.__getitem__)
+    out = None
+
+    for batch_start in range(0, len(order), BATCH_SIZE):
+        batch_idx = order[batch_start:batch_start + BATCH_SIZE]
+        cls = _forward(sess, input_names, [encodings[j] for j in batch_idx])
+
+        if out is None:
+            out = np.empty((len(encodings), cls.shape[1]), dtype=np.float32)
+        out[batch_idx] = cls
+
+    if out is not None:
+        for embedding in out:
+            yield embedding
+
+# Model shared with fork()ed embedding workers via copy-on-write; set in
+# the parent before the pool is created. The ONNX session it holds is
+# NOT reused in workers — ORT sessions don't survive fork() (their
+# intra-op thread pools exist only in the parent), so each worker
+# rebuilds its own session lazily in _embed_batch. The weight file is
+# still read once per machine thanks to the OS page cache.
+_WORKER_MODEL = None
+_WORKER_SESSION = None
+
+def _set_worker_model(model: TextEmbedding):
+    global _WORKER_MODEL
+    _WORKER_MODEL = model
+
+def _embed_batch(batch: List[str]) -> np.ndarray:
+    """Pool worker: embed one batch of chunks with a per-worker session."""
+    global _WORKER_SESSION
+    if _WORKER_SESSION is None:
+        sess, tokenizer = _session_and_tokenizer(_WORKER_MODEL)
+        tokenizer.no_padding()
+        _WORKER_SESSION = (sess, tokenizer, {i.name for i in sess.get_inputs()})
+    sess, tokenizer, input_names = _WORKER_SESSION
+    encodings = tokenizer.encode_batch(batch)
+    return _forward(sess, input_names, encodings).astype(np.float32, copy=False)
+
 def main():
     # Initialize embedding model
     print("Loading embedding model (BAAI/bge-small-en-v1.5)...")
     # Using a popular, efficient model supported by FastEmbed
     model = TextEmbedding(model_name="BAAI/bge-small-en-v1.5")
 
-    # Initialize SOA (Struct of Arrays) format
-    ids = []
-    contents = []
-    embeddings = []
-    metadatas = []
-
     if not os.path.exists(DOC_CORPUS_DIR):
         print(f"Error: Directory '{DOC_CORPUS_DIR}' not found.")
         return
@@ -90,63 +399,188 @@ def main():
     all_chunks = []
     all_metadatas = []
 
-    # 1. Read and chunk all files
-    for filename in files:
-        filepath = os.path.join(DOC_CORPUS_DIR, filename)
-        try:
-            with open(filepath, "r", encoding="utf-8") as f:
-                content = f.read()
-
-            file_chunks = chunk_text(content, CHUNK_SIZE, OVERLAP)
-
-            for i, chunk in enumerate(file_chunks):
-                all_chunks.append(chunk)
-                all_metadatas.append({
-                    "source": filename,
-                    "chunk_index": i,
-                    "version": 1,
-                    "type": "text_segment"
-                })
-        except Exception as e:
-            print(f"Error reading {filename}: {e}")
+    # 1. Read and chunk all files across cores; chunking is CPU-bound and
+    # independent per file, so this scales near-linearly. Metadata is
+    # assembled on the main process as results arrive.
+    # Metadata is kept as compact (source_idx, chunk_index) pairs and only
+    # expanded to dicts at serialization time: the shared "version"/"type"
+    # fields and the repeated source name cost nothing per chunk.
+    source_index = {name: idx for idx, name in enumerate(files)}
+    if CHUNK_UNIT == "tokens":
+        # Token chunking needs the embedder's tokenizer, so it runs on the
+        # main process. Windows are well under the model max, so document-
+        # level encoding must not truncate.
+        tokenizer = model.model.tokenizer
+        tokenizer.no_truncation()
+        # Prefetch file contents on threads so reads overlap with the
+        # CPU-bound tokenization of the previous file. The window is a
+        # fixed few files deep — submitting the whole corpus at once
+        # would buffer every completed read ahead of the tokenizer.
+        prefetch = 8
+        with ThreadPoolExecutor(max_workers=prefetch) as ex:
+            pending = deque(ex.submit(_read_file, f) for f in files[:prefetch])
+            submitted = len(pending)
+            while pending:
+                filename, content = pending.popleft().result()
+                if submitted < len(files):
+                    pending.append(ex.submit(_read_file, files[submitted]))
+                    submitted += 1
+                if content is None:
+                    continue
+                for i, chunk in enumerate(chunk_text_tokens(tokenizer, content)):
+                    all_chunks.append(chunk)
+                    all_metadatas.append((source_index[filename], i))
+    else:
+        workers = max(1, (os.cpu_count() or 2) - 1)
+        with multiprocessing.Pool(workers) as pool:
+            for filename, file_chunks in pool.imap_unordered(_read_and_chunk, files, chunksize=4):
+                for i, chunk in enumerate(file_chunks):
+                    all_chunks.append(chunk)
+                    all_metadatas.append((source_index[filename], i))
 
     if not all_chunks:
         print("No chunks generated.")
         return
 
-    print(f"Generated {len(all_chunks)} chunks. Computing embeddings...")
+    # 2. Deduplicate chunk content before embedding: overlapping windows
+    # and repeated paragraphs across files would otherwise pay a full
+    # forward pass per occurrence.
+    seen = {}
+    unique_chunks = []
+    inverse = []  # chunk index -> row in unique_chunks
+    for chunk in all_chunks:
+        key = hashlib.blake2b(chunk.encode("utf-8"), digest_size=16).digest()
+        row = seen.get(key)
+        if row is None:
+            row = len(unique_chunks)
+            seen[key] = row
+            unique_chunks.append(chunk)
+        inverse.append(row)
 
-    # 2. Generate embeddings
-    # fastembed.embed returns a generator
-    embeddings_generator = model.embed(all_chunks)
+    print(f"Generated {len(all_chunks)} chunks ({len(unique_chunks)} unique). Computing embeddings...")
 
-    # 3. Construct SOA payload
-    for i, embedding in enumerate(embeddings_generator):
-        doc_id = str(uuid.uuid4())
+    # 3. Generate embeddings for the unique chunks only.
+    uniq_mat = None
+    if EMBED_WORKERS > 0 and "fork" in multiprocessing.get_all_start_methods():
+        # Fan batches out over fork()ed workers that COW-share the model
+        # loaded above: no per-worker model load, one copy of the weights.
+        _set_worker_model(model)
+        batches = [unique_chunks[b:b + BATCH_SIZE]
+                   for b in range(0, len(unique_chunks), BATCH_SIZE)]
+        row = 0
+        with multiprocessing.get_context("fork").Pool(EMBED_WORKERS) as pool:
+            for block in pool.imap(_embed_batch, batches):
+                if uniq_mat is None:
+                    uniq_mat = np.empty((len(unique_chunks), block.shape[1]), dtype=np.float32)
+                uniq_mat[row:row + block.shape[0]] = block
+                row += block.shape[0]
+    else:
+        # In-process: tokenize everything once, then run the ONNX session
+        # over BATCH_SIZE slices.
+        for u, embedding in enumerate(embed_chunks(model, unique_chunks)):
+            if uniq_mat is None:
+                uniq_mat = np.empty((len(unique_chunks), embedding.shape[0]), dtype=np.float32)
+            uniq_mat[u] = embedding
 
-        # Append to parallel arrays (SOA format)
-        ids.append(doc_id)
-        contents.append(all_chunks[i])
-        embeddings.append(embedding.tolist())  # Convert numpy array to list
-        metadatas.append(all_metadatas[i])
+    # 4. Generate document IDs in one shot: a single os.urandom call for
+    # all the random bytes instead of one syscall plus UUID construction
+    # per chunk. version=4 keeps the IDs indistinguishable from uuid4().
+    id_blob = os.urandom(16 * len(all_chunks))
+    doc_ids = [
+        str(uuid.UUID(bytes=id_blob[j * 16:(j + 1) * 16], version=4))
+        for j in range(len(all_chunks))
+    ]
 
-    # 4. Create SOA output structure (ChromaDB-compatible)
-    output = {
-        "ids": ids,
-        "documents": contents,  # Note: field name is "documents" not "contents"
-        "embeddings": embeddings,
-        "metadatas": metadatas
-    }
+    # 5. Construct the payload, scattering unique rows back out to the
+    # memmapped .npy so the full matrix never has to sit in RAM. In SOA
+    # mode, each top-level array is streamed to its own section file as
+    # rows are produced (never an in-memory list of everything), and the
+    # sections are stitched into output.json at the end with one copy
+    # pass, so peak memory stays bounded regardless of corpus size.
+    emb_mat = np.lib.format.open_memmap(
+        EMBEDDINGS_NPY, mode="w+", dtype=np.float32,
+        shape=(len(all_chunks), uniq_mat.shape[1]))
+    jsonl_out = open(OUTPUT_JSONL, "wb") if OUTPUT_FORMAT == "jsonl" else None
+    sections = None
+    if jsonl_out is None:
+        sections = {name: open(f"{OUTPUT_FILE}.{name}.tmp", "wb")
+                    for name in ("ids", "documents", "metadatas")}
+        for section in sections.values():
+            section.write(b"[")
+
+    for i, chunk in enumerate(all_chunks):
+        emb_mat[i] = uniq_mat[inverse[i]]
+
+        doc_id = doc_ids[i]
+
+        src, chunk_index = all_metadatas[i]
+        if jsonl_out is not None:
+            # Stream the text row now; the vector is row i of the .npy
+            jsonl_out.write(orjson.dumps({
+                "id": doc_id,
+                "document": all_chunks[i],
+                "metadata": _expand_meta(files[src], chunk_index),
+            }) + b"\n")
+        else:
+            # Stream one element into each SOA section
+            sep = b"," if i else b""
+            sections["ids"].write(sep + orjson.dumps(doc_id))
+            sections["documents"].write(sep + orjson.dumps(all_chunks[i]))
+            sections["metadatas"].write(sep + orjson.dumps(_expand_meta(files[src], chunk_index)))
+
+    emb_mat.flush()
+
+    if jsonl_out is not None:
+        jsonl_out.close()
+        print(f"Success! Streamed {len(all_chunks)} rows to {OUTPUT_JSONL}")
+        print(f"Embeddings written to: {EMBEDDINGS_NPY}")
+        return
+
+    # 6. Write the embeddings section from the memmap, one batch of rows
+    # at a time (orjson emits each block; the brackets are spliced off so
+    # blocks concatenate into one array).
+    with open(f"{OUTPUT_FILE}.embeddings.tmp", "wb") as section:
+        if EMBEDDING_FORMAT == "base64":
+            # Base64-encode the raw float32 buffer: avoids per-float text
+            # conversion and shrinks the file 3-5x. The memmapped .npy
+            # already on disk gives numpy consumers a zero-copy load path.
+            section.write(orjson.dumps({
+                "dtype": "float32",
+                "shape": list(emb_mat.shape),
+                "data": base64.b64encode(emb_mat.tobytes()).decode("ascii"),
+            }))
+        else:
+            section.write(b"[")
+            for b0 in range(0, emb_mat.shape[0], BATCH_SIZE):
+                block = np.asarray(emb_mat[b0:b0 + BATCH_SIZE])
+                if b0:
+                    section.write(b",")
+                section.write(orjson.dumps(block, option=orjson.OPT_SERIALIZE_NUMPY)[1:-1])
+            section.write(b"]")
+
+    for section in sections.values():
+        section.write(b"]")
+        section.close()
 
-    # 5. Save to JSON
+    # 7. Assemble the SOA output.json (ChromaDB-compatible) by copying
+    # the four finished sections into place.
     try:
-        with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-            json.dump(output, f, indent=2)
-        print(f"Success! Generated SOA format with {len(ids)} documents")
-        print(f"  - IDs: {len(ids)} strings")
-        print(f"  - Documents: {len(contents)} text chunks")
-        print(f"  - Embeddings: {len(embeddings)} vectors of dimension {len(embeddings[0])}")
-        print(f"  - Metadatas: {len(metadatas)} objects")
+        with open(OUTPUT_FILE, "wb") as out:
+            out.write(b"{")
+            for idx, name in enumerate(("ids", "documents", "embeddings", "metadatas")):
+                if idx:
+                    out.write(b",")
+                out.write(orjson.dumps(name) + b":")
+                section_path = f"{OUTPUT_FILE}.{name}.tmp"
+                with open(section_path, "rb") as section:
+                    shutil.copyfileobj(section, out)
+                os.unlink(section_path)
+            out.write(b"}")
+        print(f"Success! Generated SOA format with {len(all_chunks)} documents")
+        print(f"  - IDs: {len(all_chunks)} strings")
+        print(f"  - Documents: {len(all_chunks)} text chunks")
+        print(f"  - Embeddings: {emb_mat.shape[0]} vectors of dimension {emb_mat.shape[1]}")
+        print(f"  - Metadatas: {len(all_metadatas)} objects")
         print(f"Output saved to: {OUTPUT_FILE}")
     except Exception as e:
         print(f"Error writing output file: {e}")
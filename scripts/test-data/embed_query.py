@@ -1,34 +1,79 @@
 import argparse
 import json
+import os
+import socket
 import sys
-from fastembed import TextEmbedding
+from typing import List, Optional
+
+# Socket of a running embed_query_server.py, if any. Using the server
+# skips the ~seconds model load that otherwise dominates each invocation.
+SOCKET_PATH = os.environ.get("EMBED_SOCKET", "/tmp/achilles-embed.sock")
+
+def embed_via_server(query: str, model: str) -> Optional[List[float]]:
+    """
+    Ask a running embed_query_server.py for the embedding. Returns None
+    if no server is listening, the reply arrives truncated, or the
+    server is warming a different model than the one requested — in all
+    three cases the caller falls back to loading the model locally.
+    """
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.connect(SOCKET_PATH)
+            s.sendall(json.dumps({"query": query, "model": model}).encode("utf-8") + b"\n")
+            buf = b""
+            while not buf.endswith(b"\n"):
+                data = s.recv(65536)
+                if not data:
+                    break
+                buf += data
+    except OSError:
+        return None
+
+    # A reply cut off mid-stream (server died or closed early) is as
+    # good as no server: don't let json.loads turn it into a hard error.
+    if not buf.endswith(b"\n"):
+        return None
+
+    result = json.loads(buf)
+    if isinstance(result, dict) and "error" in result:
+        if result.get("code") == "model_mismatch":
+            print(f"Server serves a different model ({result['error']}); "
+                  f"loading {model} locally", file=sys.stderr)
+            return None
+        raise RuntimeError(result["error"])
+    return result
 
 def main():
     parser = argparse.ArgumentParser(description="Generate embeddings for a query string using FastEmbed.")
     parser.add_argument("query", type=str, help="The query text to embed")
     parser.add_argument("--model", type=str, default="BAAI/bge-small-en-v1.5", help="The model to use (default: BAAI/bge-small-en-v1.5)")
-    
+
     args = parser.parse_args()
-    
+
     try:
-        # Initialize embedding model (suppress output if possible or just print to stderr)
-        # We print initialization logs to stderr so stdout is clean JSON
-        print(f"Loading model {args.model}...", file=sys.stderr)
-        model = TextEmbedding(model_name=args.model)
-        
-        # fastembed.embed expects a list of documents
-        embeddings_generator = model.embed([args.query])
-        
-        # Get the first (and only) embedding
-        embedding = next(embeddings_generator)
-        
+        # Prefer a running embedding server: the model is already warm there
+        embedding = embed_via_server(args.query, args.model)
+
+        if embedding is None:
+            # No server; load the model for this invocation.
+            # We print initialization logs to stderr so stdout is clean JSON
+            from fastembed import TextEmbedding
+
+            print(f"Loading model {args.model}...", file=sys.stderr)
+            model = TextEmbedding(model_name=args.model)
+
+            # fastembed.embed expects a list of documents
+            embeddings_generator = model.embed([args.query])
+
+            # Get the first (and only) embedding
+            embedding = next(embeddings_generator).tolist()
+
         # Print only the embedding list to stdout
-        print(json.dumps(embedding.tolist()))
-        
+        print(json.dumps(embedding))
+
     except Exception as e:
         print(f"Error: {e}", file=sys.stderr)
         sys.exit(1)
 
 if __name__ == "__main__":
     main()
-
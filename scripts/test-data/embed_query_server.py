@@ -0,0 +1,117 @@
+import json
+import os
+import queue
+import socketserver
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from fastembed import TextEmbedding
+
+# Loading the ONNX model dominates one-shot embed_query.py invocations.
+# This server loads it once and answers query-embedding requests over a
+# Unix socket, so per-query latency drops to the forward pass alone.
+SOCKET_PATH = os.environ.get("EMBED_SOCKET", "/tmp/achilles-embed.sock")
+MODEL_NAME = os.environ.get("EMBED_MODEL", "BAAI/bge-small-en-v1.5")
+
+# Dynamic batching: concurrent requests that arrive within the window are
+# embedded in one forward pass, amortizing tokenizer and session overhead.
+MAX_BATCH = int(os.environ.get("EMBED_MAX_BATCH", "32"))
+BATCH_WINDOW_S = float(os.environ.get("EMBED_BATCH_WINDOW_MS", "8")) / 1000.0
+
+class EmbedHandler(socketserver.StreamRequestHandler):
+    """
+    One request per connection: a JSON line {"query": "...", "model":
+    "..."} in, a JSON embedding array line out. Errors come back as
+    {"error": "...", "code": "..."}; a "model_mismatch" code tells the
+    client to load its requested model locally rather than silently
+    getting embeddings from whatever this server was started with.
+    """
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        try:
+            request = json.loads(line)
+            query = request["query"]
+            requested = request.get("model")
+            if requested is not None and requested != MODEL_NAME:
+                self.wfile.write(json.dumps(
+                    {"error": MODEL_NAME, "code": "model_mismatch"}
+                ).encode("utf-8") + b"\n")
+                return
+            embedding = self.server.embed(query)
+            self.wfile.write(json.dumps(embedding.tolist()).encode("utf-8") + b"\n")
+        except Exception as e:
+            self.wfile.write(json.dumps({"error": str(e)}).encode("utf-8") + b"\n")
+
+class EmbedServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, model: TextEmbedding):
+        self.model = model
+        self.requests = queue.Queue()
+        self._batcher = threading.Thread(target=self._drain_batches, daemon=True)
+        self._batcher.start()
+        super().__init__(socket_path, EmbedHandler)
+
+    def embed(self, query: str):
+        """Queue a query for the batching worker and wait for its embedding."""
+        fut = Future()
+        self.requests.put((query, fut))
+        return fut.result()
+
+    def _drain_batches(self):
+        """
+        Block for the next request, then keep collecting until the batch
+        window closes or MAX_BATCH is reached, and embed the whole batch
+        in one forward pass. A lone request pays at most the window
+        (a few ms) in added latency.
+        """
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.monotonic() + BATCH_WINDOW_S
+            while len(batch) < MAX_BATCH:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            queries = [query for query, _ in batch]
+            try:
+                embeddings = self.model.embed(queries, batch_size=len(queries))
+                for (_, fut), embedding in zip(batch, embeddings):
+                    fut.set_result(embedding)
+            except Exception as e:
+                for _, fut in batch:
+                    fut.set_exception(e)
+
+def main():
+    print(f"Loading model {MODEL_NAME}...", file=sys.stderr)
+    model = TextEmbedding(model_name=MODEL_NAME)
+
+    # Remove a stale socket from a previous run
+    try:
+        os.unlink(SOCKET_PATH)
+    except FileNotFoundError:
+        pass
+
+    server = EmbedServer(SOCKET_PATH, model)
+    print(f"Serving embeddings on {SOCKET_PATH}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        try:
+            os.unlink(SOCKET_PATH)
+        except FileNotFoundError:
+            pass
+
+if __name__ == "__main__":
+    main()